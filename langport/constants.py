@@ -3,8 +3,8 @@ from enum import IntEnum
 
 HEART_BEAT_EXPIRATION = 90
 WORKER_HEART_BEAT_INTERVAL = 30
-EMBEDDING_INFERENCE_INTERVAL = 0.1
-GENERATION_INFERENCE_INTERVAL = 0.5
+INFERENCE_IDLE_INTERVAL = 1.0
+MICRO_BATCH_WINDOW = 0.01
 WORKER_API_TIMEOUT = 20
 
 LOGDIR = "./logs"
@@ -3,7 +3,7 @@ from collections import defaultdict
 import logging
 import json
 import time
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Set
 
 import httpx
 from langport.core.base_node import BaseNode
@@ -56,17 +56,13 @@ class ClusterNode(BaseNode):
         self.remote_states: Dict[str, Dict[str, CacheState]] = defaultdict(dict)
 
         self.client = AsyncHttpPool()
+        self.heartbeat_task: Optional[asyncio.Task] = None
+        # node_id never changes, build the heartbeat payload once
+        self.heartbeat_payload = HeartbeatPing(node_id=self.node_id).dict()
+        # neighbors which answered a heartbeat with exist=False, re-registered on the next tick
+        self.reregister_nodes: Set[str] = set()
         
         # timers
-        self.add_timer(
-            "heartbeat",
-            WORKER_HEART_BEAT_INTERVAL,
-            self.send_heartbeat_broadcast,
-            args=None,
-            kwargs=None,
-            workers=1,
-        )
-
         self.add_timer(
             "expiration_check",
             HEART_BEAT_EXPIRATION // 2,
@@ -79,7 +75,10 @@ class ClusterNode(BaseNode):
         # start and stop
         self.on_start("get_all_init_neighborhoods", self.get_all_init_neighborhoods)
         self.on_start("register_node_broadcast", self.register_self_node_broadcast)
+        self.on_start("start_heartbeat", self.start_heartbeat)
+        self.on_stop("stop_heartbeat", self.stop_heartbeat)
         self.on_stop("remove_node_broadcast", self.remove_self_node_broadcast)
+        self.on_stop("close_http_client", self.client.aclose)
     
     def _add_node(self, node_id: str, node_addr: str, check_heart_beat: bool=True):
         self.neighborhoods[node_id] = NodeInfo(
@@ -101,6 +100,17 @@ class ClusterNode(BaseNode):
         if node_id in self.neighborhoods:
             del self.neighborhoods[node_id]
     
+    async def _post(self, url: str, data: Dict[str, Any]) -> Any:
+        response = await self.client.post(
+            url,
+            headers=self.headers,
+            json=data,
+            timeout=WORKER_API_TIMEOUT,
+        )
+        if not response.is_success:
+            raise RuntimeError(f"Request to {url} failed with status {response.status_code}.")
+        return response.json()
+
     async def get_all_init_neighborhoods(self):
         for neighbor_addr in self.init_neighborhoods_addr:
             try:
@@ -113,13 +123,11 @@ class ClusterNode(BaseNode):
         self._add_node(self.node_id, self.node_addr, True)
     
     async def get_node_info(self, node_addr: str) -> NodeInfo:
-        response = await self.client.post(
+        response = await self._post(
             node_addr + "/node_info",
-            headers=self.headers,
-            json=NodeInfoRequest(node_id=self.node_id).dict(),
-            timeout=WORKER_API_TIMEOUT,
+            NodeInfoRequest(node_id=self.node_id).dict(),
         )
-        remote_node_info = NodeInfoResponse.parse_obj(response.json())
+        remote_node_info = NodeInfoResponse.parse_obj(response)
         return remote_node_info.node_info
 
     async def register_node(self, target_node_addr: str, register_node_id: str, register_node_addr: str) -> bool:
@@ -135,13 +143,8 @@ class ClusterNode(BaseNode):
                 check_heart_beat=True,
             )
         
-            response = await self.client.post(
-                target_node_addr + "/register_node",
-                headers=self.headers,
-                json=data.dict(),
-                timeout=WORKER_API_TIMEOUT,
-            )
-            remote = RegisterNodeResponse.parse_obj(response.json())
+            response = await self._post(target_node_addr + "/register_node", data.dict())
+            remote = RegisterNodeResponse.parse_obj(response)
             self._add_node(remote.node_id, remote.node_addr)
             
             # fetch remote node info
@@ -172,13 +175,8 @@ class ClusterNode(BaseNode):
             node_id=removed_node_id,
         )
 
-        response = await self.client.post(
-            target_node_addr + "/remove_node",
-            headers=self.headers,
-            json=data.dict(),
-            timeout=WORKER_API_TIMEOUT,
-        )
-        ret = RemoveNodeResponse.parse_obj(response.json())
+        response = await self._post(target_node_addr + "/remove_node", data.dict())
+        ret = RemoveNodeResponse.parse_obj(response)
 
         return True
 
@@ -193,18 +191,12 @@ class ClusterNode(BaseNode):
     async def remove_self_node_broadcast(self):
         await self.remove_node_broadcast(self.node_id)
 
-    async def send_heartbeat(self, node_addr: str):
-        data = HeartbeatPing(
-            node_id=self.node_id,
-        )
-        response = await self.client.post(
-            node_addr + "/heartbeat",
-            headers=self.headers,
-            json=data.dict(),
-            timeout=WORKER_API_TIMEOUT,
-        )
-        ret = HeartbeatPong.parse_obj(response.json())
-  
+    async def send_heartbeat(self, node_id: str, node_addr: str):
+        response = await self._post(node_addr + "/heartbeat", self.heartbeat_payload)
+        ret = HeartbeatPong.parse_obj(response)
+        if not ret.exist:
+            # do not block this tick on registering again, the next heartbeat does it
+            self.reregister_nodes.add(node_id)
         return ret
 
     async def send_heartbeat_broadcast(self):
@@ -220,20 +212,37 @@ class ClusterNode(BaseNode):
         for node_id, node_info in neighborhoods.items():
             if node_id == self.node_id:
                 continue
-            await self.send_heartbeat(node_info.node_addr)
+            if node_id in self.reregister_nodes:
+                self.reregister_nodes.discard(node_id)
+                await self.register_node(node_info.node_addr, self.node_id, self.node_addr)
+            else:
+                await self.send_heartbeat(node_id, node_info.node_addr)
         
+    async def start_heartbeat(self):
+        # Heartbeats share the serving event loop (and its pooled connections) instead of a timer thread.
+        if self.heartbeat_task is None:
+            self.heartbeat_task = asyncio.create_task(self.heartbeat_loop())
+
+    async def stop_heartbeat(self):
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
+
+    async def heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(WORKER_HEART_BEAT_INTERVAL)
+            try:
+                await self.send_heartbeat_broadcast()
+            except Exception:
+                self.logger.exception("Failed to send heartbeat.")
+
     async def fetch_all_nodes(self, node_addr: str):
         data = NodeListRequest(
             node_id=self.node_id,
         )
 
-        response = await self.client.post(
-            node_addr + "/node_list",
-            headers=self.headers,
-            json=data.dict(),
-            timeout=WORKER_API_TIMEOUT,
-        )
-        ret = NodeListResponse.parse_obj(response.json())
+        response = await self._post(node_addr + "/node_list", data.dict())
+        ret = NodeListResponse.parse_obj(response)
   
         return ret
 
@@ -252,13 +261,8 @@ class ClusterNode(BaseNode):
             state_name=name,
         )
 
-        response = await self.client.post(
-            node_addr + "/get_node_state",
-            headers=self.headers,
-            json=data.dict(),
-            timeout=WORKER_API_TIMEOUT,
-        )
-        ret = GetNodeStateResponse.parse_obj(response.json())
+        response = await self._post(node_addr + "/get_node_state", data.dict())
+        ret = GetNodeStateResponse.parse_obj(response)
 
         return ret
     
@@ -325,9 +329,10 @@ class ClusterNode(BaseNode):
     async def api_receive_heartbeat(self, request: HeartbeatPing) -> HeartbeatPong:
         if request.node_id in self.neighborhoods:
             self.neighborhoods[request.node_id].refresh_time = int(time.time())
+            return HeartbeatPong(exist=True)
         else:
             self.logger.info(f"Invalid ping packet from {request.node_id}.")
-        return HeartbeatPong(exist=True)
+            return HeartbeatPong(exist=False)
     
     async def api_return_node_list(self, request: NodeListRequest) -> NodeListResponse:
         node_list = [node_info for node_id, node_info in self.neighborhoods.items()]
@@ -1,11 +1,13 @@
 import asyncio
-from collections import defaultdict
+from collections import deque
 import logging
 import json
 import re
-from typing import Dict, List, Optional
+import threading
+import time
+import traceback
+from typing import Any, Callable, Deque, Dict, Iterable, List, Mapping, Optional
 
-import queue
 from langport.core.cluster_node import ClusterNode
 
 from langport.protocol.worker_protocol import (
@@ -17,6 +19,8 @@ from langport.protocol.worker_protocol import (
 
 from langport.constants import (
     HEART_BEAT_EXPIRATION,
+    INFERENCE_IDLE_INTERVAL,
+    MICRO_BATCH_WINDOW,
     WORKER_API_TIMEOUT,
     WORKER_HEART_BEAT_INTERVAL,
     ErrorCode,
@@ -33,6 +37,7 @@ class ClusterWorker(ClusterNode):
         max_batch: int,
         stream_interval: int,
         logger: logging.Logger,
+        batch_window: float = MICRO_BATCH_WINDOW,
     ):
         super(ClusterWorker, self).__init__(
             node_addr=node_addr,
@@ -44,18 +49,88 @@ class ClusterWorker(ClusterNode):
         self.limit_model_concurrency = limit_model_concurrency
         self.max_batch = max_batch
         self.stream_interval = stream_interval
+        self.batch_window = batch_window
 
         self.global_counter = 0
         self.model_semaphore = None
 
-        self.task_queue: queue.Queue[BaseWorkerTask] = queue.Queue()
-        self.output_queue: Dict[str, queue.Queue[BaseWorkerResult]] = defaultdict(
-            queue.Queue
-        )
+        # deque append/popleft are atomic, so executor threads can drain it without a lock.
+        self.task_queue: Deque[BaseWorkerTask] = deque()
+        # Results are pushed from executor threads and consumed on the event loop.
+        self.output_queue: Dict[str, asyncio.Queue[BaseWorkerResult]] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # Inference threads sleep on this event and are woken up by add_task.
+        self.task_event = threading.Event()
+        self.inference_running = True
+        self.inference_threads: Dict[str, List[threading.Thread]] = {}
+        self.num_running_inference = 0
+        self.num_running_inference_lock = threading.Lock()
 
+        self.on_start("bind_event_loop", self.bind_event_loop)
         self.on_start("set_queue_state", self.set_queue_state)
         self.on_start("set_features", self.set_features)
         self.on_start("set_speed", self.set_speed)
+        self.on_stop("stop_inference_loops", self.stop_inference_loops)
+
+    def add_inference_loop(
+        self,
+        name: str,
+        fn: Callable,
+        args: Optional[Iterable[Any]] = None,
+        kwargs: Optional[Mapping[str, Any]] = None,
+        workers: int = 1,
+    ) -> bool:
+        if name in self.inference_threads:
+            return False
+        args = args if args is not None else []
+        kwargs = kwargs if kwargs is not None else {}
+        threads = []
+        for i in range(workers):
+            thread = threading.Thread(
+                target=self._inference_loop, args=(fn, args, kwargs), daemon=True
+            )
+            threads.append(thread)
+            thread.start()
+        self.inference_threads[name] = threads
+        return True
+
+    def _inference_loop(self, fn: Callable, args: Iterable[Any], kwargs: Mapping[str, Any]):
+        while self.inference_running:
+            # Wake up on new tasks, or periodically so that executors can run idle work (e.g. sleep).
+            self.task_event.wait(timeout=INFERENCE_IDLE_INTERVAL)
+            self.task_event.clear()
+            # If nothing is running, wait a moment for more tasks to arrive and batch them together.
+            # Skip it when the batch is already full or another inference is busy anyway.
+            if (
+                self.batch_window > 0
+                and self.num_running_inference == 0
+                and 0 < self.get_num_tasks() < self.max_batch
+            ):
+                time.sleep(self.batch_window)
+            with self.num_running_inference_lock:
+                self.num_running_inference += 1
+            try:
+                fn(*args, **kwargs)
+            except:
+                traceback.print_exc()
+            finally:
+                with self.num_running_inference_lock:
+                    self.num_running_inference -= 1
+            # Tasks left over from a partial fetch should not wait for the next arrival.
+            if self.get_num_tasks() > 0:
+                self.task_event.set()
+
+    def stop_inference_loops(self):
+        # Runs on the event loop, so do not join: a thread may be in the middle of a long batch.
+        # The threads are daemons and exit once their current call returns. Like the timers,
+        # inference loops are created in __init__ and are not restarted by a later start().
+        self.inference_running = False
+        self.task_event.set()
+        self.inference_threads.clear()
+
+    async def bind_event_loop(self):
+        self.loop = asyncio.get_running_loop()
 
     async def set_queue_state(self):
         await self.set_local_state("queue_length", self.get_queue_length(), ttl=16)
@@ -84,31 +159,29 @@ class ClusterWorker(ClusterNode):
             return 0
         else:
             return (
-                self.task_queue.qsize()
+                len(self.task_queue)
                 + len(self.model_semaphore._waiters)
             )
 
     async def add_task(self, task: BaseWorkerTask):
-        self.task_queue.put(task, block=True, timeout=WORKER_API_TIMEOUT)
-        self.output_queue[task.task_id] = queue.Queue()
+        self.output_queue[task.task_id] = asyncio.Queue()
+        self.task_queue.append(task)
+        self.task_event.set()
         await self.set_queue_state()
 
     async def fetch_task_result(self, task_id: str):
         result_queue = self.output_queue[task_id]
-        retry_counter = 0
         while True:
             await self.set_queue_state()
             try:
-                event = result_queue.get(block=False, timeout=None)
-            except queue.Empty:
-                await asyncio.sleep(0.01)
-                retry_counter += 1
-                # If client disconnected, stop to wait queue.
-                if retry_counter > 2000:
+                # Buffered chunks are yielded right away, only an empty queue waits (with a timeout).
+                event = result_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                try:
+                    event = await asyncio.wait_for(result_queue.get(), timeout=WORKER_API_TIMEOUT)
+                except asyncio.TimeoutError:
+                    # If client disconnected, stop to wait queue.
                     break
-                else:
-                    continue
-            retry_counter = 0
             if event.type == "done":
                 break
             elif event.type == "error":
@@ -122,25 +195,29 @@ class ClusterWorker(ClusterNode):
             else:
                 raise ValueError("Bad chunk type.")
 
-        del self.output_queue[task_id]
+        self.output_queue.pop(task_id, None)
 
     def get_num_tasks(self) -> int:
-        return self.task_queue.qsize()
+        return len(self.task_queue)
 
-    def fetch_tasks(self, task_num: Optional[int]=None) -> List[BaseWorkerResult]:
+    def fetch_tasks(self, task_num: Optional[int]=None) -> List[BaseWorkerTask]:
         if task_num is None:
             task_num = self.max_batch
         task_batch = []
         while len(task_batch) < task_num:
             try:
-                task = self.task_queue.get(block=False, timeout=None)
-            except queue.Empty:
+                task = self.task_queue.popleft()
+            except IndexError:
                 break
             task_batch.append(task)
         return task_batch
 
     def push_task_result(self, task_id: str, response: BaseWorkerResult):
-        self.output_queue[task_id].put(response, block=True, timeout=WORKER_API_TIMEOUT)
+        result_queue = self.output_queue.get(task_id, None)
+        if result_queue is None:
+            # The consumer has gone away, drop the result.
+            return
+        self.loop.call_soon_threadsafe(result_queue.put_nowait, response)
 
     async def api_get_worker_address(self, request: WorkerAddressRequest) -> WorkerAddressResponse:
         id_list, address_list, values = await self.get_worker_address(request.condition, request.expression)
@@ -4,8 +4,9 @@ From FastChat: https://github.com/lm-sys/FastChat/blob/main/fastchat/conversatio
 """
 
 import dataclasses
+import re
 from enum import auto, Enum
-from typing import List, Any, Optional, Tuple
+from typing import Callable, Dict, List, Any, Optional, Tuple
 
 
 class SeparatorStyle(Enum):
@@ -72,149 +73,15 @@ class ConversationHistory:
     
     def get_prompt(self) -> str:
         """Get the prompt for generation."""
+        builder = _PROMPT_BUILDERS.get(self.settings.sep_style, None)
+        if builder is None:
+            raise ValueError(f"Invalid style: {self.settings.sep_style}")
         if self.settings.round_sep is not None:
             round_sep = self.settings.round_sep
         else:
             round_sep = ""
         system_prompt = self.settings.system_template.format(system_message=self.system)
-        if self.settings.sep_style == SeparatorStyle.ADD_COLON_SINGLE:
-            ret = system_prompt + self.settings.sep
-            for i, (role, message) in enumerate(self.messages):
-                if i % len(self.settings.roles) == 0:
-                    ret += round_sep
-                if message:
-                    ret += role + ": " + message + self.settings.sep
-                else:
-                    ret += role + ":"
-            return ret
-        elif self.settings.sep_style == SeparatorStyle.ADD_COLON_TWO:
-            seps = [self.settings.sep, self.settings.sep2]
-            ret = system_prompt + seps[0]
-            
-            for i, (role, message) in enumerate(self.messages):
-                if i % len(self.settings.roles) == 0:
-                    ret += round_sep
-                if message:
-                    ret += role + ": " + message + seps[i % 2]
-                else:
-                    ret += role + ":"
-            return ret
-        elif self.settings.sep_style == SeparatorStyle.NO_COLON_SINGLE:
-            ret = system_prompt + self.settings.sep
-            
-            for i, (role, message) in enumerate(self.messages):
-                if i % len(self.settings.roles) == 0:
-                    ret += round_sep
-                if message:
-                    ret += role + message + self.settings.sep
-                else:
-                    ret += role
-            return ret
-        elif self.settings.sep_style == SeparatorStyle.NO_COLON_TWO:
-            seps = [self.settings.sep, self.settings.sep2]
-            ret = system_prompt + seps[0]
-            for i, (role, message) in enumerate(self.messages):
-                if message:
-                    ret += role + message + seps[i % 2]
-                else:
-                    ret += role
-            return ret
-        elif self.settings.sep_style == SeparatorStyle.ADD_NEW_LINE_SINGLE:
-            ret = "" if system_prompt == "" else system_prompt + self.settings.sep
-
-            for i, (role, message) in enumerate(self.messages):
-                if i % len(self.settings.roles) == 0:
-                    ret += round_sep
-                
-                if message:
-                    ret += role + "\n" + message + self.settings.sep
-                else:
-                    ret += role + "\n"
-            return ret
-        elif self.settings.sep_style == SeparatorStyle.DOLLY:
-            seps = [self.settings.sep, self.settings.sep2]
-            ret = system_prompt
-            for i, (role, message) in enumerate(self.messages):
-                if message:
-                    ret += role + ":\n" + message + seps[i % 2]
-                    if i % 2 == 1:
-                        ret += "\n\n"
-                else:
-                    ret += role + ":\n"
-            return ret
-        elif self.settings.sep_style == SeparatorStyle.RWKV:
-            ret = system_prompt + self.settings.sep
-            for i, (role, message) in enumerate(self.messages):
-                if message:
-                    ret += (
-                        role
-                        + ": "
-                        + message.replace("\r\n", "\n").replace("\n\n", "\n")
-                    )
-                    ret += "\n\n"
-                else:
-                    ret += role + ":"
-            return ret
-        elif self.settings.sep_style == SeparatorStyle.PHOENIX:
-            ret = system_prompt
-            for role, message in self.messages:
-                if message:
-                    ret += role + ": " + "<s>" + message + "</s>"
-                else:
-                    ret += role + ": " + "<s>"
-            return ret
-        elif self.settings.sep_style == SeparatorStyle.CHATGLM:
-            if system_prompt:
-                ret = system_prompt + self.settings.sep
-            else:
-                ret = ""
-            for i, (role, message) in enumerate(self.messages):
-                if message:
-                    if i % 2 == 0:
-                        ret += f"[Round {i+1}]\n\n"
-                    ret += role + "：" + message + self.settings.sep
-                else:
-                    ret += role + "："
-            return ret
-        elif self.settings.sep_style == SeparatorStyle.LLAMA:
-            B_INST, E_INST = "[INST]", "[/INST]"
-            if system_prompt:
-                ret = system_prompt + self.settings.sep
-            else:
-                ret = ""
-            
-            if self.messages[0][0] == "system":
-                self.messages.pop(0)
-            for i, (role, message) in enumerate(self.messages):
-                if i % 2 == 0:
-                    inst = B_INST + " "
-                else:
-                    inst = E_INST + " "
-                if i == 0:
-                    inst = ""
-                if message:
-                    if i % 2 == 0:
-                        ret += inst + message.strip() + " "
-                    else:
-                        ret += inst + message.strip() + " "
-                    if i == len(self.messages) - 1:
-                        ret += E_INST
-                else:
-                    ret += E_INST
-
-            return ret
-        elif self.settings.sep_style == SeparatorStyle.CHATLM:
-            im_start, im_end = "<|im_start|>", "<|im_end|>"
-            ret = system_prompt + self.settings.sep
-
-            for i, (role, message) in enumerate(self.messages):
-                if message:
-                    ret += im_start + role + "\n" + message + im_end + self.settings.sep
-                else:
-                    ret += im_start + role + "\n"
-            return ret
-        else:
-            raise ValueError(f"Invalid style: {self.settings.sep_style}")
+        return builder(self, system_prompt, round_sep)
 
     def append_message(self, role: str, message: str):
         """Append a new message."""
@@ -258,3 +125,170 @@ class ConversationHistory:
             "settings": self.settings,
         }
 
+
+def _build_add_colon_single(history: ConversationHistory, system_prompt: str, round_sep: str) -> str:
+    sep = history.settings.sep
+    num_roles = len(history.settings.roles)
+    ret = [system_prompt, sep]
+    for i, (role, message) in enumerate(history.messages):
+        if i % num_roles == 0:
+            ret.append(round_sep)
+        if message:
+            ret.append(f"{role}: {message}{sep}")
+        else:
+            ret.append(f"{role}:")
+    return "".join(ret)
+
+
+def _build_add_colon_two(history: ConversationHistory, system_prompt: str, round_sep: str) -> str:
+    seps = [history.settings.sep, history.settings.sep2]
+    num_roles = len(history.settings.roles)
+    ret = [system_prompt, seps[0]]
+    for i, (role, message) in enumerate(history.messages):
+        if i % num_roles == 0:
+            ret.append(round_sep)
+        if message:
+            ret.append(f"{role}: {message}{seps[i % 2]}")
+        else:
+            ret.append(f"{role}:")
+    return "".join(ret)
+
+
+def _build_no_colon_single(history: ConversationHistory, system_prompt: str, round_sep: str) -> str:
+    sep = history.settings.sep
+    num_roles = len(history.settings.roles)
+    ret = [system_prompt, sep]
+    for i, (role, message) in enumerate(history.messages):
+        if i % num_roles == 0:
+            ret.append(round_sep)
+        if message:
+            ret.append(f"{role}{message}{sep}")
+        else:
+            ret.append(role)
+    return "".join(ret)
+
+
+def _build_no_colon_two(history: ConversationHistory, system_prompt: str, round_sep: str) -> str:
+    seps = [history.settings.sep, history.settings.sep2]
+    ret = [system_prompt, seps[0]]
+    for i, (role, message) in enumerate(history.messages):
+        if message:
+            ret.append(f"{role}{message}{seps[i % 2]}")
+        else:
+            ret.append(role)
+    return "".join(ret)
+
+
+def _build_add_new_line_single(history: ConversationHistory, system_prompt: str, round_sep: str) -> str:
+    sep = history.settings.sep
+    num_roles = len(history.settings.roles)
+    ret = [] if system_prompt == "" else [system_prompt, sep]
+    for i, (role, message) in enumerate(history.messages):
+        if i % num_roles == 0:
+            ret.append(round_sep)
+        if message:
+            ret.append(f"{role}\n{message}{sep}")
+        else:
+            ret.append(f"{role}\n")
+    return "".join(ret)
+
+
+def _build_dolly(history: ConversationHistory, system_prompt: str, round_sep: str) -> str:
+    seps = [history.settings.sep, history.settings.sep2]
+    ret = [system_prompt]
+    for i, (role, message) in enumerate(history.messages):
+        if message:
+            ret.append(f"{role}:\n{message}{seps[i % 2]}")
+            if i % 2 == 1:
+                ret.append("\n\n")
+        else:
+            ret.append(f"{role}:\n")
+    return "".join(ret)
+
+
+# Same result as message.replace("\r\n", "\n").replace("\n\n", "\n") in a single pass.
+_RWKV_NEWLINE_RE = re.compile(r"(?:\r\n|\n)(?:\r\n|\n)|\r\n")
+
+
+def _build_rwkv(history: ConversationHistory, system_prompt: str, round_sep: str) -> str:
+    ret = [system_prompt, history.settings.sep]
+    for i, (role, message) in enumerate(history.messages):
+        if message:
+            message = _RWKV_NEWLINE_RE.sub("\n", message)
+            ret.append(f"{role}: {message}\n\n")
+        else:
+            ret.append(f"{role}:")
+    return "".join(ret)
+
+
+def _build_phoenix(history: ConversationHistory, system_prompt: str, round_sep: str) -> str:
+    ret = [system_prompt]
+    for role, message in history.messages:
+        if message:
+            ret.append(f"{role}: <s>{message}</s>")
+        else:
+            ret.append(f"{role}: <s>")
+    return "".join(ret)
+
+
+def _build_chatglm(history: ConversationHistory, system_prompt: str, round_sep: str) -> str:
+    sep = history.settings.sep
+    ret = [system_prompt, sep] if system_prompt else []
+    for i, (role, message) in enumerate(history.messages):
+        if message:
+            if i % 2 == 0:
+                ret.append(f"[Round {i+1}]\n\n")
+            ret.append(f"{role}：{message}{sep}")
+        else:
+            ret.append(f"{role}：")
+    return "".join(ret)
+
+
+def _build_llama(history: ConversationHistory, system_prompt: str, round_sep: str) -> str:
+    B_INST, E_INST = "[INST]", "[/INST]"
+    ret = [system_prompt, history.settings.sep] if system_prompt else []
+
+    if history.messages[0][0] == "system":
+        history.messages.pop(0)
+    last_i = len(history.messages) - 1
+    for i, (role, message) in enumerate(history.messages):
+        if i == 0:
+            inst = ""
+        elif i % 2 == 0:
+            inst = B_INST + " "
+        else:
+            inst = E_INST + " "
+        if message:
+            ret.append(f"{inst}{message.strip()} ")
+            if i == last_i:
+                ret.append(E_INST)
+        else:
+            ret.append(E_INST)
+    return "".join(ret)
+
+
+def _build_chatlm(history: ConversationHistory, system_prompt: str, round_sep: str) -> str:
+    im_start, im_end = "<|im_start|>", "<|im_end|>"
+    sep = history.settings.sep
+    ret = [system_prompt, sep]
+    for i, (role, message) in enumerate(history.messages):
+        if message:
+            ret.append(f"{im_start}{role}\n{message}{im_end}{sep}")
+        else:
+            ret.append(f"{im_start}{role}\n")
+    return "".join(ret)
+
+
+_PROMPT_BUILDERS: Dict[SeparatorStyle, Callable[[ConversationHistory, str, str], str]] = {
+    SeparatorStyle.ADD_COLON_SINGLE: _build_add_colon_single,
+    SeparatorStyle.ADD_COLON_TWO: _build_add_colon_two,
+    SeparatorStyle.NO_COLON_SINGLE: _build_no_colon_single,
+    SeparatorStyle.NO_COLON_TWO: _build_no_colon_two,
+    SeparatorStyle.ADD_NEW_LINE_SINGLE: _build_add_new_line_single,
+    SeparatorStyle.DOLLY: _build_dolly,
+    SeparatorStyle.RWKV: _build_rwkv,
+    SeparatorStyle.PHOENIX: _build_phoenix,
+    SeparatorStyle.CHATGLM: _build_chatglm,
+    SeparatorStyle.LLAMA: _build_llama,
+    SeparatorStyle.CHATLM: _build_chatlm,
+}
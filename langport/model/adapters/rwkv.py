@@ -1,3 +1,5 @@
+from functools import cache
+
 from transformers import (
     AutoTokenizer,
 )
@@ -7,6 +9,17 @@ from langport.data.conversation.conversation_settings import get_conv_settings
 from langport.model.model_adapter import BaseAdapter
 
 
+@cache
+def _rwkv_conv_template() -> ConversationHistory:
+    settings = get_conv_settings("rwkv")
+    return ConversationHistory(
+        system="",
+        messages=[],
+        offset=0,
+        settings=settings,
+    )
+
+
 class RwkvAdapter(BaseAdapter):
     """The model adapter for BlinkDL/RWKV-4-Raven"""
 
@@ -14,10 +27,5 @@ class RwkvAdapter(BaseAdapter):
         return "RWKV-4" in model_path
 
     def get_default_conv_template(self, model_path: str) -> ConversationHistory:
-        settings = get_conv_settings("rwkv")
-        return ConversationHistory(
-            system="",
-            messages=(),
-            offset=0,
-            settings=settings,
-        )
+        # Callers append messages, so hand out a copy of the cached template.
+        return _rwkv_conv_template().copy()
@@ -49,6 +49,7 @@ class HuggingfaceEmbeddingExecutor(HuggingfaceExecutor):
         self.adapter, self.model, self.tokenizer = self.load_model(
             model_path, device, num_gpus, max_gpu_memory, quantization, cpu_offloading, deepspeed, gptq, group_size, trust_remote_code, offload_folder
         )
+        self.model.eval()
 
         if hasattr(self.model.config, "max_sequence_length"):
             self._context_len = self.model.config.max_sequence_length
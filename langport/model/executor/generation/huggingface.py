@@ -1,3 +1,4 @@
+import threading
 import time
 import traceback
 from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
@@ -57,7 +58,8 @@ def prepare_logits_processor(
     return processor_list
 
 class BatchingTask:
-    def __init__(self, tasks: List[GenerationTask], tokenizer: PreTrainedTokenizer, device: str, is_encoder_decoder: bool) -> None:
+    def __init__(self, tasks: List[GenerationTask], tokenizer: PreTrainedTokenizer, device: str, is_encoder_decoder: bool,
+                 prompts_ids: Optional[List[List[int]]]=None) -> None:
         self.batch_size = len(tasks)
         if self.batch_size == 0:
             return
@@ -68,7 +70,10 @@ class BatchingTask:
         
         # collect params
         self.tasks = tasks
-        self.prompts_ids = [self.tokenizer(task.prompt, return_tensors="pt").input_ids.squeeze(0) for task in tasks]
+        if prompts_ids is None:
+            self.prompts_ids = [self.tokenizer(task.prompt, return_tensors="pt").input_ids.squeeze(0) for task in tasks]
+        else:
+            self.prompts_ids = [torch.tensor(ids, dtype=torch.long) for ids in prompts_ids]
         self.prompts_ids_length = [len(i) for i in self.prompts_ids]
         self.min_prompts_length = min(self.prompts_ids_length)
         self.max_prompts_length = max(self.prompts_ids_length)
@@ -88,6 +93,11 @@ class BatchingTask:
                 task.temperature, task.repetition_penalty, task.top_p, task.top_k
             )
             self.logits_processor_list.append(logits_processor)
+        # tasks with the same sampling params share a processor and are processed together
+        self.logits_processor_groups: Dict[Tuple[float, float, float, int], List[int]] = {}
+        for task_i, task in enumerate(tasks):
+            params = (task.temperature, task.repetition_penalty, task.top_p, task.top_k)
+            self.logits_processor_groups.setdefault(params, []).append(task_i)
         
         # variables used in the streaming process
         self.batch_tokens_cache: List[List[int]] = [[] for i in range(self.batch_size)]
@@ -235,9 +245,33 @@ class GenerationModel:
         else:
             full_encoder_outputs = None
             decoder_input_ids_list: List[torch.LongTensor] = [full_input_ids]
+        # Token history of every task for logits processors (e.g. repetition penalty).
+        # The model itself only receives the prompt once and the new tokens afterwards.
+        # Preallocated for the whole generation, so each step writes one column.
+        history_length = decoder_input_ids_list[0].shape[1]
+        history_ids = torch.full(
+            (inputs.batch_size, history_length + max_new_tokens), inputs.pad_fill_id,
+            dtype=torch.long, device=decoder_input_ids_list[0].device
+        )
+        history_ids[:, :history_length] = decoder_input_ids_list[0]
+        if not self.model.config.is_encoder_decoder:
+            # Left padding is not part of the prompt. Fill it with the first prompt token of the row,
+            # so that repetition penalty never hits the pad token (often eos).
+            for task_i, length in enumerate(inputs.prompts_ids_length):
+                pad_length = history_length - length
+                if 0 < pad_length < history_length:
+                    history_ids[task_i, :pad_length] = history_ids[task_i, pad_length]
         
         encoder_outputs = full_encoder_outputs
-        attention_mask = full_attention_mask
+        # attention mask of the prompt followed by all generated positions
+        prompt_length = full_attention_mask.shape[1]
+        attention_mask = torch.cat(
+            (full_attention_mask,
+            torch.ones(
+                full_attention_mask.shape[0], max_new_tokens,
+                dtype=torch.long, device=full_attention_mask.device
+            )), dim=1
+        )
         past_key_values: Optional[List[Tuple[torch.Tensor, torch.Tensor]]] = None
         bacth_mapping: List[int] = list(range(inputs.batch_size)) # dynamic batch
 
@@ -253,72 +287,91 @@ class GenerationModel:
             if self.model.config.is_encoder_decoder:
                 out = self.model.decoder(
                     input_ids=decoder_input_ids,
-                    use_cache=self.model.generation_config.use_cache,
+                    use_cache=True,
                     encoder_outputs=encoder_outputs,
                     past_key_values=past_key_values,
                 )
             else:
-                if step > 0:
-                    dynamic_attention_mask = torch.cat(
-                        (attention_mask, 
-                        torch.ones(
-                            attention_mask.shape[0], step,
-                            dtype=torch.long, device=attention_mask.device
-                        )), dim=1
-                    )
-                else:
-                    dynamic_attention_mask = attention_mask
+                dynamic_attention_mask = attention_mask[:, :prompt_length + step]
                 out = self.model(
                     input_ids=decoder_input_ids,
                     attention_mask=dynamic_attention_mask,
-                    use_cache=self.model.generation_config.use_cache,
+                    use_cache=True,
                     past_key_values=past_key_values,
                 )
             logits = out.logits
             past_key_values = out.past_key_values
             decoder_input_ids_list = []
 
-            new_ids = []
             # logprobs
             token_probs = [None] * inputs.batch_size
             top_logprobs = [None] * inputs.batch_size
 
-            for task_i, task in enumerate(inputs.tasks):
-                if inputs.is_stop(task_i):
-                    new_ids.append(inputs.pad_fill_id)
+            active_tasks = [task_i for task_i in range(inputs.batch_size) if not inputs.is_stop(task_i)]
+            # keep the raw logits for logprobs
+            last_token_logits = logits[:, -1, :].clone()
+            for params, group in inputs.logits_processor_groups.items():
+                group_tasks = [task_i for task_i in group if not inputs.is_stop(task_i)]
+                if len(group_tasks) == 0:
                     continue
-                batch_i = bacth_mapping[task_i]
-                each_logits = logits[batch_i, -1, :].unsqueeze(0)
-
-                logits_processor = inputs.get_logits_processor_list(task_i)
-                if logits_processor:
-                    if task.repetition_penalty > 1.0:
-                        tmp_output_ids = decoder_input_ids[batch_i, :].unsqueeze(0)
-                    else:
-                        tmp_output_ids = None
-                    last_token_logits = logits_processor(tmp_output_ids, each_logits)[0]
+                logits_processor = inputs.get_logits_processor_list(group_tasks[0])
+                if not logits_processor:
+                    continue
+                repetition_penalty = params[1]
+                if repetition_penalty > 1.0 and len(group_tasks) == inputs.batch_size:
+                    # a plain slice is a view, indexing rows with a list would copy the history
+                    tmp_output_ids = history_ids[:, :history_length + step]
+                elif repetition_penalty > 1.0:
+                    tmp_output_ids = history_ids[group_tasks, :history_length + step]
                 else:
-                    last_token_logits = each_logits[0]
-
+                    tmp_output_ids = None
+                if len(group_tasks) == len(active_tasks):
+                    last_token_logits = logits_processor(tmp_output_ids, last_token_logits)
+                else:
+                    rows = [bacth_mapping[task_i] for task_i in group_tasks]
+                    last_token_logits[rows] = logits_processor(tmp_output_ids, last_token_logits[rows])
+
+            # sample the whole batch at once
+            greedy = [
+                inputs.tasks[task_i].temperature < 1e-5 or inputs.tasks[task_i].top_p < 1e-8
+                for task_i in active_tasks
+            ]
+            if all(greedy):
+                # argmax is fine on every backend, no need to leave the device
+                tokens = torch.argmax(last_token_logits, dim=-1)
+            else:
                 if self.model.device.type == "mps":
                     # Switch to CPU by avoiding some bugs in mps backend.
                     last_token_logits = last_token_logits.float().to("cpu")
-
-                if task.temperature < 1e-5 or task.top_p < 1e-8:  # greedy
-                    token = int(torch.argmax(last_token_logits))
-                else:
-                    probs = torch.softmax(last_token_logits, dim=-1)
-                    sampled_tensor = torch.multinomial(probs, num_samples=2, replacement=False)
-                    token = int(sampled_tensor[0].item())
-                
-                if task.logprobs is not None:
-                    token_probs[task_i] = each_logits[0, token].item()
-                    top_values, top_indices = torch.topk(each_logits[0, :], task.logprobs, dim=-1, largest=True, sorted=True)
-                    item = {}
-                    for top_i in range(len(top_values)):
-                        item[top_indices[top_i].item()] = top_values[top_i].item()
-                    top_logprobs[task_i] = item
-                new_ids.append(token)
+                probs = torch.softmax(last_token_logits, dim=-1)
+                tokens = torch.multinomial(probs, num_samples=1).squeeze(1)
+                if any(greedy):
+                    greedy_mask = torch.tensor(greedy, dtype=torch.bool, device=tokens.device)
+                    tokens = torch.where(greedy_mask, torch.argmax(last_token_logits, dim=-1), tokens)
+            tokens = tokens.to(history_ids.device, non_blocking=True)
+            # the only device to host sync of the step
+            active_new_ids = tokens.tolist()
+
+            # logprobs, rows of logits are in the same order as active_tasks
+            logprobs_rows = [
+                active_i for active_i, task_i in enumerate(active_tasks)
+                if inputs.tasks[task_i].logprobs is not None
+            ]
+            if len(logprobs_rows) > 0:
+                raw_logits = logits[logprobs_rows, -1, :]
+                max_logprobs = max(inputs.tasks[active_tasks[active_i]].logprobs for active_i in logprobs_rows)
+                chosen_values = raw_logits.gather(1, tokens[logprobs_rows].to(raw_logits.device).unsqueeze(1)).squeeze(1).tolist()
+                top_values, top_indices = torch.topk(raw_logits, max_logprobs, dim=-1, largest=True, sorted=True)
+                top_values, top_indices = top_values.tolist(), top_indices.tolist()
+                for row_i, active_i in enumerate(logprobs_rows):
+                    task_i = active_tasks[active_i]
+                    num_logprobs = inputs.tasks[task_i].logprobs
+                    token_probs[task_i] = chosen_values[row_i]
+                    top_logprobs[task_i] = dict(zip(top_indices[row_i][:num_logprobs], top_values[row_i][:num_logprobs]))
+
+            new_ids = [inputs.pad_fill_id] * inputs.batch_size
+            for active_i, task_i in enumerate(active_tasks):
+                new_ids[task_i] = active_new_ids[active_i]
             
             is_stop_before = [s for s in inputs.stop]
             # update state
@@ -328,15 +381,17 @@ class GenerationModel:
             is_stop_after = [s for s in inputs.stop]
             stop_event = is_stop_before != is_stop_after
             
-            # setup next step input and cache
-            if self.model.config.is_encoder_decoder or self.model.generation_config.use_cache:
-                # print("use cache!")
-                dynamic_new_ids = [d for i, d in enumerate(new_ids) if not inputs.is_stop(i)]
-                new_ids_tensor = torch.tensor(dynamic_new_ids, dtype=torch.long, device=decoder_input_ids.device).unsqueeze(1)
-                decoder_input_ids_list = [new_ids_tensor]
+            # rows of finished tasks keep the pad id they were allocated with
+            if len(active_tasks) == inputs.batch_size:
+                history_ids[:, history_length + step] = tokens
             else:
-                decoder_input_ids = inputs(return_attention_mask=False, full_batch=False)
-                decoder_input_ids_list = [decoder_input_ids]
+                history_ids[active_tasks, history_length + step] = tokens
+
+            # setup next step input, past tokens are served from the kv cache
+            if stop_event:
+                keep_rows = [active_i for active_i, task_i in enumerate(active_tasks) if not inputs.is_stop(task_i)]
+                tokens = tokens[keep_rows]
+            decoder_input_ids_list = [tokens.unsqueeze(1)]
             
             # shrink encoder_outputs
             if self.model.config.is_encoder_decoder and stop_event:
@@ -402,6 +457,7 @@ class GenerationModel:
             streamer.end()
 
         del past_key_values
+        del history_ids
 
 class GenerationWorkerStreamer(BaseStreamer):
     def __init__(self,
@@ -414,6 +470,21 @@ class GenerationWorkerStreamer(BaseStreamer):
         self.stream_interval = worker.stream_interval
 
         self.done = [False for i in range(task_batch.batch_size)]
+        # incremental detokenization state
+        self.texts = ["" for i in range(task_batch.batch_size)]
+        self.decode_offsets = [(0, 0) for i in range(task_batch.batch_size)]
+    
+    def decode_incremental(self, idx: int, token_ids: List[int]) -> str:
+        # Only decode the tokens since the last read offset, keeping a few tokens
+        # of prefix so that tokenizers which strip leading spaces stay consistent.
+        prefix_offset, read_offset = self.decode_offsets[idx]
+        prefix_text = self.tokenizer.decode(token_ids[prefix_offset:read_offset], skip_special_tokens=False)
+        new_text = self.tokenizer.decode(token_ids[prefix_offset:], skip_special_tokens=False)
+        # Wait for more tokens if the last one is an incomplete utf-8 sequence.
+        if len(new_text) > len(prefix_text) and not new_text.endswith("\ufffd"):
+            self.texts[idx] += new_text[len(prefix_text):]
+            self.decode_offsets[idx] = (read_offset, len(token_ids))
+        return self.texts[idx]
     
     @cached(cache=LRUCache(maxsize=8192))
     def convert_tokens_to_string(self, tokens: List[str]) -> str:
@@ -466,7 +537,10 @@ class GenerationWorkerStreamer(BaseStreamer):
                 if tasks[i].stop_token_ids is not None and last_token in tasks[i].stop_token_ids:
                     token_ids = token_ids[:-1]
 
-            text = self.tokenizer.decode(token_ids, skip_special_tokens=False)
+            if self.task_batch.is_stop(i):
+                text = self.tokenizer.decode(token_ids, skip_special_tokens=False)
+            else:
+                text = self.decode_incremental(i, token_ids)
             # text = self.convert_tokens_to_string(tuple(tokens))
 
             # get logprobs
@@ -631,6 +705,10 @@ class HuggingfaceGenerationExecutor(HuggingfaceExecutor):
             self._context_len = 2048
         
         self.current_batch = 2
+
+        # prompts are tokenized by the worker before they are queued, share the results with inference
+        self.tokenize_cache = LRUCache(maxsize=256)
+        self.tokenize_lock = threading.Lock()
     
     def _record_call_time(self):
         self.last_call_time = time.time()
@@ -666,7 +744,12 @@ class HuggingfaceGenerationExecutor(HuggingfaceExecutor):
         return self._context_len
     
     def tokenize(self, text: str) -> List[int]:
-        input_ids = self.tokenizer(text).input_ids
+        with self.tokenize_lock:
+            input_ids = self.tokenize_cache.get(text, None)
+        if input_ids is None:
+            input_ids = self.tokenizer(text).input_ids
+            with self.tokenize_lock:
+                self.tokenize_cache[text] = input_ids
         return input_ids
     
     def inference(self, worker: "GenerationModelWorker"):
@@ -688,7 +771,8 @@ class HuggingfaceGenerationExecutor(HuggingfaceExecutor):
         
         # batch inference
         tasks = sorted(tasks, key=lambda x:len(x.prompt), reverse=True)
-        inputs = BatchingTask(tasks, self.tokenizer, self.device, self.model.config.is_encoder_decoder)
+        prompts_ids = [self.tokenize(task.prompt) for task in tasks]
+        inputs = BatchingTask(tasks, self.tokenizer, self.device, self.model.config.is_encoder_decoder, prompts_ids)
         
         if torch.cuda.is_available() and "cuda" in self.device:
             if self.device == "cuda":
@@ -41,6 +41,8 @@ from langport.model.model_adapter import get_model_adapter, raise_warning_for_in
 from langport.model.monkey_patch_non_inplace import replace_llama_attn_with_non_inplace_operations
 from langport.utils import get_gpu_memory
 
+# Allow TF32 matmuls on Ampere and newer GPUs, the precision loss does not matter for serving.
+torch.backends.cuda.matmul.allow_tf32 = True
 
 
 class HuggingfaceExecutor(LocalModelExecutor):
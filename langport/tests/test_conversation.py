@@ -9,6 +9,7 @@ from langport.data.conversation.settings.chatgpt import chatgpt
 from langport.data.conversation.settings.llama import llama
 from langport.data.conversation.settings.openbuddy import openbuddy
 from langport.data.conversation.settings.qwen import qwen
+from langport.data.conversation.settings.rwkv import rwkv
 from langport.data.conversation.settings.starchat import starchat
 
 class TestLlamaMethods(unittest.TestCase):
@@ -208,5 +209,20 @@ class TestStarChatMethods(unittest.TestCase):
         )
         self.assertEqual(history.get_prompt(), "<|system|>\nSYSTEM_MESSAGE<|end|>\n<|user|>\naaa<|end|>\n<|assistant|>\n")
 
+class TestRWKVMethods(unittest.TestCase):
+
+    def test_conv(self):
+        history = ConversationHistory(
+            "SYSTEM_MESSAGE",
+            messages=[
+                (rwkv.roles[0], "aaa\r\n\nccc"),
+                (rwkv.roles[1], "bbb\n\n\nddd"),
+                (rwkv.roles[0], None),
+            ],
+            offset=0,
+            settings=rwkv
+        )
+        self.assertEqual(history.get_prompt(), "SYSTEM_MESSAGEBob: aaa\nccc\n\nAlice: bbb\n\nddd\n\nBob:")
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,24 +1,37 @@
+import asyncio
+from typing import Dict
+
 import httpx
 
 class AsyncHttpPool(object):
-    def __init__(self) -> None:
-        pass
+    def __init__(self, max_connections: int = 16, max_keepalive_connections: int = 8) -> None:
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
+        # httpx clients are bound to the event loop they are used on, keep one per loop.
+        self._clients: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop, None)
+        if client is None or client.is_closed:
+            for old_loop in [l for l in list(self._clients) if l.is_closed()]:
+                self._clients.pop(old_loop, None)
+            client = httpx.AsyncClient(limits=self.limits)
+            self._clients[loop] = client
+        return client
 
     async def get(self, *args, **kwarg):
-        client = httpx.AsyncClient()
-        response = await client.get(*args, **kwarg)
-        await client.aclose()
-        return response
+        return await self._get_client().get(*args, **kwarg)
     
     async def post(self, *args, **kwarg):
-        client = httpx.AsyncClient()
-        response = await client.post(*args, **kwarg)
-        await client.aclose()
-        return response
+        return await self._get_client().post(*args, **kwarg)
     
     def stream(self, *args, **kwarg):
-        with httpx.AsyncClient() as client:
-            return client.stream(*args, **kwarg)
+        return self._get_client().stream(*args, **kwarg)
 
     async def aclose(self):
-        pass
\ No newline at end of file
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
@@ -24,16 +24,22 @@ class IntervalTimer(object):
 
         self._timer = threading.Thread(target=self.run)
         self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        # Each executor thread keeps its own event loop, so that resources bound
+        # to a loop (e.g. pooled http connections) survive between calls.
+        self._local = threading.local()
         self.is_activated = False
         self.last_time = time.time()
+        self._cancel_event = threading.Event()
 
     def start(self):
         self.is_activated = True
+        self._cancel_event.clear()
         self.last_time = time.time()
         self._timer.start()
 
     def cancel(self):
         self.is_activated = False
+        self._cancel_event.set()
         self._timer.join()
 
     def function_wrapper(
@@ -43,30 +49,26 @@ class IntervalTimer(object):
     ):
         try:
             if inspect.iscoroutinefunction(self.fn):
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
+                loop = self._get_event_loop()
                 loop.run_until_complete(self.fn(*args, **kwargs))
-                loop.close()
             else:
                 self.fn(*args, **kwargs)
         except:
             traceback.print_exc()
 
+    def _get_event_loop(self) -> asyncio.AbstractEventLoop:
+        loop = getattr(self._local, "loop", None)
+        if loop is None or loop.is_closed():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            self._local.loop = loop
+        return loop
+
     def run(self):
-        while True:
-            if self.is_activated:
-                start_time = time.time()
-                if start_time - self.last_time > self.interval:
-                    self._executor.submit(self.function_wrapper, self.args, self.kwargs)
-                    self.last_time = time.time()
-                    # Never run this code, because finish_time - start_time = 0.
-                    # if finish_time - start_time > self.interval:
-                    #     print(
-                    #         f"Overloaded!! Last timer using {finish_time - start_time}s."
-                    #     )
-                    # else:
-                        # time.sleep(0.01)
-                else:
-                    time.sleep(0.01)
-            else:
+        # Sleep until the next deadline instead of polling, cancel() wakes the thread up.
+        while self.is_activated:
+            wait_time = self.last_time + self.interval - time.time()
+            if self._cancel_event.wait(timeout=max(wait_time, 0.0)):
                 break
+            self._executor.submit(self.function_wrapper, self.args, self.kwargs)
+            self.last_time = time.time()
@@ -21,9 +21,9 @@ import traceback
 import torch
 
 from langport.constants import (
+    MICRO_BATCH_WINDOW,
     WORKER_API_TIMEOUT,
     WORKER_HEART_BEAT_INTERVAL,
-    EMBEDDING_INFERENCE_INTERVAL,
     ErrorCode,
 )
 from langport.utils import server_error_msg, pretty_print_semaphore
@@ -38,7 +38,8 @@ class EmbeddingModelWorker(ClusterWorker):
         limit_model_concurrency: int,
         max_batch: int,
         stream_interval: int,
-        logger
+        logger,
+        batch_window: float = MICRO_BATCH_WINDOW,
     ):
         super(EmbeddingModelWorker, self).__init__(
             node_addr=node_addr,
@@ -48,12 +49,12 @@ class EmbeddingModelWorker(ClusterWorker):
             max_batch=max_batch,
             stream_interval=stream_interval,
             logger=logger,
+            batch_window=batch_window,
         )
         self.executor = executor
         workers = max(1, self.limit_model_concurrency)
-        self.add_timer(
+        self.add_inference_loop(
             "embeddings_inference", 
-            EMBEDDING_INFERENCE_INTERVAL, 
             executor.inference, 
             args=(self,), 
             kwargs=None, 
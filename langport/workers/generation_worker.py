@@ -1,3 +1,4 @@
+import asyncio
 import json
 from typing import List
 
@@ -12,7 +13,7 @@ from langport.protocol.worker_protocol import (
 )
 
 from langport.constants import (
-    GENERATION_INFERENCE_INTERVAL,
+    MICRO_BATCH_WINDOW,
     WORKER_API_TIMEOUT,
     WORKER_HEART_BEAT_INTERVAL,
     ErrorCode,
@@ -29,7 +30,8 @@ class GenerationModelWorker(ClusterWorker):
         limit_model_concurrency: int,
         max_batch: int,
         stream_interval: int,
-        logger
+        logger,
+        batch_window: float = MICRO_BATCH_WINDOW,
     ):
         super(GenerationModelWorker, self).__init__(
             node_addr=node_addr,
@@ -39,12 +41,12 @@ class GenerationModelWorker(ClusterWorker):
             max_batch=max_batch,
             stream_interval=stream_interval,
             logger=logger,
+            batch_window=batch_window,
         )
         self.executor = executor
         workers = max(1, self.limit_model_concurrency)
-        self.add_timer(
+        self.add_inference_loop(
             "generation_inference",
-            GENERATION_INFERENCE_INTERVAL,
             self.executor.inference,
             args=[self,],
             kwargs=None,
@@ -61,7 +63,11 @@ class GenerationModelWorker(ClusterWorker):
         await self.set_local_state("model_name", self.executor.model_name, ttl=360)
 
     async def generation_stream(self, task: GenerationTask):
-        prompt_tokens = len(self.executor.tokenize(task.prompt))
+        # Tokenize off the event loop, executors may cache the ids for inference.
+        prompt_ids = await asyncio.get_running_loop().run_in_executor(
+            None, self.executor.tokenize, task.prompt
+        )
+        prompt_tokens = len(prompt_ids)
         max_tokens = task.max_tokens
         context_length = self.executor.context_length
 